@@ -1,18 +1,66 @@
 import argparse
+import copy
+import hmac
+import os
 import signal
 import threading
-from typing import Optional
+from functools import partial
+from typing import Callable, Optional
 
 from dnslib import CLASS, QTYPE, RCODE, RR, TXT, DNSRecord
 from dnslib.server import DNSServer, BaseResolver, DNSLogger
 
-from utils.ai_providers import generate_with_provider
+from utils.ai_providers import (
+    TIMEOUT_ERRORS,
+    TRANSIENT_ERRORS,
+    ProviderUnavailableError,
+    enable_response_cache,
+    enable_semantic_cache,
+    generate_with_provider,
+)
+from utils.cache import MemoryCache
+from utils.logger import get_logger
 from utils.text_formatting import (
     chunk_text_for_txt_record,
     extract_api_key_and_question,
+    normalize_prompt,
 )
+from utils.udp_server import BatchedUDPServer
 from config import DNS_API_KEY
 
+logger = get_logger()
+
+# Encoded once so authentication doesn't re-encode the configured key per query
+_DNS_API_KEY_BYTES = DNS_API_KEY.encode("utf-8") if DNS_API_KEY else b""
+
+# Short TXT answer sent when the provider doesn't respond in time
+LLM_TIMEOUT_ANSWER = "[LLM timeout, try again]"
+# Sent when the provider fails or is in its post-failure cooldown
+LLM_UNAVAILABLE_ANSWER = "[LLM unavailable, try again]"
+
+# Common UTF-8 punctuation rewritten to ASCII equivalents in a single pass
+_ASCII_TABLE = str.maketrans(
+    {
+        "\u2018": "'",
+        "\u2019": "'",
+        "\u201c": '"',
+        "\u201d": '"',
+        "\u2014": "--",
+        "\u2013": "-",
+        "\u2026": "...",
+    }
+)
+
+
+def _postprocess(answer: str, max_output_chars: int) -> str:
+    """Make an LLM answer DNS-ready: ASCII punctuation and the length cap"""
+    # Replace common UTF-8 characters with ASCII equivalents for better DNS display
+    answer = answer.translate(_ASCII_TABLE)
+
+    if max_output_chars > 0 and len(answer) > max_output_chars:
+        answer = answer[: max_output_chars - 10].rstrip() + "..."
+    return answer
+
 
 class LLMResolver(BaseResolver):
     def __init__(
@@ -21,32 +69,73 @@ class LLMResolver(BaseResolver):
         model: Optional[str] = None,
         max_output_chars: int = 800,
         require_api_key: bool = False,
+        cache_ttl: Optional[int] = None,
     ):
         self.provider_name = provider_name
         self.model = model
         # Keep payload small enough for UDP (~512 bytes). 800 chars split into 4x200-byte TXT chunks.
         self.max_output_chars = max_output_chars
         self.require_api_key = require_api_key
+        # Every answer shares type/class/TTL; copy this per reply and fill in the rest
+        self._txt_rr = RR(rtype=QTYPE.TXT, rclass=CLASS.IN, ttl=0, rdata=TXT([]))
+        # Final DNS-ready answers keyed by normalized question, so cache hits skip
+        # both the LLM call and post-processing. The original question is what
+        # gets sent to the LLM. Uses the same TTL as the persistent cache.
+        self.answer_cache = MemoryCache(maxsize=4096, ttl=cache_ttl)
 
     def llm_answer(self, question: str) -> str:
-        answer = generate_with_provider(
-            question, provider=self.provider_name, model=self.model
-        )
-        # Replace common UTF-8 characters with ASCII equivalents for better DNS display
-        answer = (
-            answer.replace(""", "'").replace(""", "'")
-            .replace('"', '"')
-            .replace('"', '"')
-            .replace("—", "--")
-            .replace("–", "-")
-            .replace("…", "...")
-        )
+        key = normalize_prompt(question)
+        answer = self.answer_cache.get(key)
+        if answer is not None:
+            self._log_cache("hit")
+            return answer
+
+        # Fallback answers are not cached: the next query tries the provider again
+        try:
+            answer = generate_with_provider(
+                question,
+                provider=self.provider_name,
+                model=self.model,
+                max_output_chars=self.max_output_chars,
+            )
+        except TIMEOUT_ERRORS:
+            logger.warning("LLM call timed out for prompt %r", question)
+            return LLM_TIMEOUT_ANSWER
+        except (ProviderUnavailableError, *TRANSIENT_ERRORS):
+            return LLM_UNAVAILABLE_ANSWER
 
-        if self.max_output_chars > 0 and len(answer) > self.max_output_chars:
-            answer = answer[: self.max_output_chars - 10].rstrip() + "..."
+        answer = _postprocess(answer, self.max_output_chars)
+        self.answer_cache.set(key, answer)
+        self._log_cache("miss")
         return answer
 
+    def _log_cache(self, outcome: str) -> None:
+        cache = self.answer_cache
+        logger.info(
+            "Response cache %s (hits=%d, misses=%d)", outcome, cache.hits, cache.misses
+        )
+
     def resolve(self, request: DNSRecord, handler):  # type: ignore[override]
+        return self._resolve(request, self.llm_answer)
+
+    def resolve_cached(self, request: DNSRecord) -> Optional[DNSRecord]:
+        """Answer without calling the LLM, or return None if it would be needed.
+
+        Used by BatchedUDPServer on its reader thread so cache hits and rejected
+        queries never wait behind slow LLM calls in the worker pool.
+        """
+        return self._resolve(request, self.cached_answer)
+
+    def cached_answer(self, question: str) -> Optional[str]:
+        # A miss here is counted by the llm_answer() call that follows it
+        answer = self.answer_cache.get(normalize_prompt(question), count_miss=False)
+        if answer is not None:
+            self._log_cache("hit")
+        return answer
+
+    def _resolve(
+        self, request: DNSRecord, answer_fn: Callable[[str], Optional[str]]
+    ) -> Optional[DNSRecord]:
         qname = request.q.qname
         qtype = request.q.qtype
         reply = request.reply()
@@ -65,23 +154,24 @@ class LLMResolver(BaseResolver):
                 reply.header.rcode = RCODE.SERVFAIL
                 return reply
 
-            if provided_api_key != DNS_API_KEY:
+            # Constant-time comparison so response timing doesn't leak the key.
+            # Compare as bytes: compare_digest rejects non-ASCII str.
+            if not hmac.compare_digest(
+                (provided_api_key or "").encode("utf-8"), _DNS_API_KEY_BYTES
+            ):
                 # Authentication failed - return REFUSED
                 reply.header.rcode = RCODE.REFUSED
                 return reply
 
-        answer = self.llm_answer(question)
+        answer = answer_fn(question)
+        if answer is None:
+            return None
 
         txt_chunks = chunk_text_for_txt_record(answer, max_chunk_bytes=200)
-        reply.add_answer(
-            RR(
-                rname=qname,
-                rtype=QTYPE.TXT,
-                rclass=CLASS.IN,
-                ttl=0,
-                rdata=TXT(txt_chunks),
-            )
-        )
+        rr = copy.copy(self._txt_rr)
+        rr.rname = qname
+        rr.rdata = TXT(txt_chunks)
+        reply.add_answer(rr)
         return reply
 
 
@@ -92,18 +182,48 @@ def run_server(
     model: Optional[str] = None,
     max_output_chars: int = 800,
     require_api_key: bool = False,
+    semantic_cache_threshold: Optional[float] = None,
+    cache_db: Optional[str] = None,
+    cache_ttl: int = 3600,
+    workers: int = 1,
 ) -> None:
-    resolver = LLMResolver(provider_name, model, max_output_chars, require_api_key)
+    if cache_db:
+        enable_response_cache(cache_db, cache_ttl)
+    if semantic_cache_threshold is not None:
+        enable_semantic_cache(semantic_cache_threshold, cache_ttl)
+
+    resolver = LLMResolver(
+        provider_name, model, max_output_chars, require_api_key, cache_ttl
+    )
 
     logger = DNSLogger(prefix=False)
-    udp_server = DNSServer(resolver, port=port, address=host, logger=logger)
+    # With several workers each binds its own SO_REUSEPORT socket, and the
+    # kernel fans incoming packets out across them
+    reuse_port = workers > 1
+    cpu_count = os.cpu_count() or 1
+    udp_servers = [
+        DNSServer(
+            resolver,
+            port=port,
+            address=host,
+            logger=logger,
+            server=partial(
+                BatchedUDPServer,
+                reuse_port=reuse_port,
+                incoming_cpu=i % cpu_count if reuse_port else None,
+            ),
+        )
+        for i in range(max(workers, 1))
+    ]
     tcp_server = DNSServer(resolver, port=port, address=host, tcp=True, logger=logger)
 
-    udp_server.start_thread()
+    for udp_server in udp_servers:
+        udp_server.start_thread()
     tcp_server.start_thread()
 
     print(
-        f"LLM-over-DNS listening on {host}:{port} (UDP/TCP), provider={provider_name}"
+        f"LLM-over-DNS listening on {host}:{port} (UDP/TCP), provider={provider_name}, "
+        f"udp_workers={len(udp_servers)}"
     )
     stop_event = threading.Event()
 
@@ -117,7 +237,8 @@ def run_server(
         while not stop_event.is_set():
             stop_event.wait(0.5)
     finally:
-        udp_server.stop()
+        for udp_server in udp_servers:
+            udp_server.stop()
         tcp_server.stop()
 
 
@@ -162,6 +283,34 @@ def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
         action="store_true",
         help="Require API key authentication for queries (set DNS_API_KEY in .env)",
     )
+    parser.add_argument(
+        "--semantic-cache",
+        action="store_true",
+        help="Reuse answers for paraphrased questions via OpenAI embeddings (needs numpy)",
+    )
+    parser.add_argument(
+        "--semantic-threshold",
+        type=float,
+        default=0.9,
+        help="Cosine similarity required for a semantic cache hit (default: 0.9)",
+    )
+    parser.add_argument(
+        "--cache-db",
+        default=None,
+        help="SQLite file for a persistent response cache (default: disabled)",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=3600,
+        help="Seconds cached responses stay valid, in memory and on disk (default: 3600)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="UDP sockets to bind with SO_REUSEPORT, one serving thread each (default: 1)",
+    )
     return parser.parse_args(argv)
 
 
@@ -175,6 +324,12 @@ def main() -> None:
         model=args.model,
         max_output_chars=args.max_chars,
         require_api_key=args.require_api_key,
+        semantic_cache_threshold=(
+            args.semantic_threshold if args.semantic_cache else None
+        ),
+        cache_db=args.cache_db,
+        cache_ttl=args.cache_ttl,
+        workers=args.workers,
     )
 
 
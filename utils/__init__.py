@@ -1 +1 @@
-__all__ = ["text_formatting", "ai_providers", "logger"]
+__all__ = ["text_formatting", "ai_providers", "cache", "logger", "udp_server"]
@@ -1,27 +1,265 @@
-from typing import Optional
-from openai import OpenAI
+import asyncio
+import concurrent.futures
+import hashlib
+import threading
+import time
+from typing import Awaitable, List, Optional, Tuple, TypeVar
+import openai
+from openai import AsyncOpenAI
 import anthropic
+from utils.cache import ResponseCache, make_key
 from utils.logger import get_logger
 from config import OPENAI_API_KEY, ANTHROPIC_API_KEY
 
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the optional semantic cache
+    np = None
+
 # Set up logging
 logger = get_logger()
 
-# Initialize LLM clients
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+T = TypeVar("T")
+
+# Per-attempt timeouts bound how long a stuck provider call can hold a DNS query.
+# SDK retries are off: a retried attempt would outlast any DNS client. dig and
+# stub resolvers resend after ~5s instead, and single-flight joins the resend
+# to the call already in progress, so an answer within ~10s still reaches them.
+openai_timeout = 4.0
+anthropic_timeout = 8.0
+
+# Initialize LLM clients. They are async so that a single background event loop
+# multiplexes every in-flight LLM call instead of blocking one thread per call.
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY).with_options(
+    timeout=openai_timeout, max_retries=0
+)
 openai_model = "gpt-4.1-mini"  # faster models gpt-4.1-mini
 
-anthropic_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+anthropic_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY).with_options(
+    timeout=anthropic_timeout, max_retries=0
+)
 anthropic_model = "claude-sonnet-4-20250514"
 
+# Shared instruction prefix for every request. Anthropic calls mark it for prompt
+# caching, so changing this text (or adding per-request content ahead of it)
+# invalidates the cached prefix.
+system_instructions = "Give me back text only, no markdown or other formatting"
+anthropic_system = [
+    {
+        "type": "text",
+        "text": system_instructions,
+        "cache_control": {"type": "ephemeral"},
+    }
+]
+
+embedding_model = "text-embedding-3-small"
+embedding_dim = 1536
+
+# Seconds a DNS worker thread waits for an LLM call, including the semantic
+# cache embedding, before giving up. Kept just above the slowest client timeout
+# so the fallback TXT goes out while a resending DNS client is still listening.
+request_timeout = 9.0
+
+_loop = asyncio.new_event_loop()
+threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+
+# Persistent response cache, disabled unless enable_response_cache() is called
+response_cache: Optional[ResponseCache] = None
+
+
+def enable_response_cache(path: str, ttl: int = 3600) -> ResponseCache:
+    """Turn on the SQLite response cache for generate_with_provider"""
+    global response_cache
+    response_cache = ResponseCache(path, ttl=ttl)
+    purged = response_cache.purge_expired()
+    logger.info(
+        "Response cache at %s (ttl=%ss, purged %d expired)", path, ttl, purged
+    )
+    return response_cache
+
+
+class ProviderUnavailableError(RuntimeError):
+    """Raised without calling the provider while it is cooling down after a failure"""
+
+
+class StreamError(openai.APIError):
+    """Raised for an error or response.failed event in an OpenAI response stream"""
+
+
+# Seconds to stop calling a provider after a rate-limit, server or network error
+provider_cooldown_seconds = 5.0
+_provider_cooldown: dict[str, float] = {}
+
+# Failures that indicate the provider itself is struggling, not a bad request
+TRANSIENT_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+    anthropic.RateLimitError,
+    anthropic.InternalServerError,
+    anthropic.APIConnectionError,
+    StreamError,
+)
+
+# A single slow prompt, not an outage, so these don't start a cooldown. The SDK
+# timeouts are APIConnectionError subclasses; TimeoutError is the loop wait.
+TIMEOUT_ERRORS = (openai.APITimeoutError, anthropic.APITimeoutError, TimeoutError)
+
+
+# Single-flight map of in-progress generations, keyed by request hash
+_inflight: dict[str, concurrent.futures.Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _run_on_loop(coro: Awaitable[T], timeout: Optional[float] = request_timeout) -> T:
+    """Run a coroutine on the shared LLM event loop and block until it finishes"""
+    future = asyncio.run_coroutine_threadsafe(coro, _loop)
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+
+class SemanticCache:
+    """Cache answers by prompt embedding so paraphrased questions share a response.
+
+    Embeddings are stored as unit vectors in a float32 matrix that doubles in
+    size until it holds max_entries rows, then acts as a ring buffer that
+    overwrites the oldest entry; lookups are a single matrix-vector product.
+    With a ttl, entries older than that many seconds are never matched.
+    Entries are not partitioned by provider or model, since a server process
+    only ever talks to one of each.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        capacity: int = 256,
+        max_entries: int = 4096,
+        ttl: Optional[float] = None,
+    ):
+        if np is None:
+            raise RuntimeError(
+                "numpy is required for the semantic cache: pip install numpy"
+            )
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        rows = min(capacity, max_entries)
+        self._embeddings = np.empty((rows, embedding_dim), dtype=np.float32)
+        self._added_at = np.empty(rows, dtype=np.float64)  # monotonic insert times
+        self._answers: List[str] = []
+        self._next = 0  # ring buffer slot to overwrite once full
+        self._lock = threading.Lock()
+
+    def embed(
+        self, prompt: str, timeout: Optional[float] = request_timeout
+    ) -> "np.ndarray":
+        """Embed a prompt with OpenAI and normalize it to unit length"""
+        response = _run_on_loop(
+            openai_client.embeddings.create(model=embedding_model, input=prompt),
+            timeout,
+        )
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: "np.ndarray") -> Optional[str]:
+        """Return the cached answer most similar to embedding, if above threshold"""
+        with self._lock:
+            size = len(self._answers)
+            if size == 0:
+                return None
+            scores = self._embeddings[:size] @ embedding
+            if self.ttl is not None:
+                expired = self._added_at[:size] <= time.monotonic() - self.ttl
+                scores[expired] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] > self.threshold:
+                return self._answers[best]
+        return None
+
+    def add(self, embedding: "np.ndarray", answer: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            size = len(self._answers)
+            if size == self.max_entries:
+                self._embeddings[self._next] = embedding
+                self._added_at[self._next] = now
+                self._answers[self._next] = answer
+                self._next = (self._next + 1) % self.max_entries
+                return
+            if size == self._embeddings.shape[0]:
+                rows = min(size * 2, self.max_entries)
+                grown = np.empty((rows, embedding_dim), dtype=np.float32)
+                grown[:size] = self._embeddings
+                self._embeddings = grown
+                added_at = np.empty(rows, dtype=np.float64)
+                added_at[:size] = self._added_at
+                self._added_at = added_at
+            self._embeddings[size] = embedding
+            self._added_at[size] = now
+            self._answers.append(answer)
+
+
+# Disabled unless enable_semantic_cache() is called
+semantic_cache: Optional[SemanticCache] = None
 
-def generate_with_openai(prompt: str, model: Optional[str] = None) -> str:
-    """Generate response using OpenAI API"""
+
+def enable_semantic_cache(
+    threshold: float = 0.9, ttl: Optional[float] = None
+) -> SemanticCache:
+    """Turn on the semantic cache for generate_with_provider"""
+    global semantic_cache
+    semantic_cache = SemanticCache(threshold=threshold, ttl=ttl)
+    return semantic_cache
+
+
+async def generate_with_openai(
+    prompt: str, model: Optional[str] = None, max_output_chars: int = 0
+) -> str:
+    """Generate response using OpenAI API
+
+    With max_output_chars set, the response is streamed and the stream is closed
+    as soon as more text than that has arrived: callers truncate to that length
+    anyway, so generating the rest only costs tokens and latency.
+    """
     model_to_use = model or openai_model
     try:
-        response = openai_client.responses.create(
+        if max_output_chars > 0:
+            stream = await openai_client.responses.create(
+                model=model_to_use,
+                instructions=system_instructions,
+                input=prompt,
+                # ~4 chars per token, so this only caps runaway generations
+                max_output_tokens=max(16, max_output_chars // 3),
+                stream=True,
+            )
+            parts: List[str] = []
+            length = 0
+            try:
+                async for event in stream:
+                    # The SDK doesn't raise for these, so a failed generation
+                    # would otherwise come back (and be cached) as a short answer
+                    if event.type == "error":
+                        raise StreamError(event.message, request=None, body=None)
+                    if event.type == "response.failed":
+                        error = event.response.error
+                        message = error.message if error else "response failed"
+                        raise StreamError(message, request=None, body=None)
+                    if event.type == "response.output_text.delta":
+                        parts.append(event.delta)
+                        length += len(event.delta)
+                        if length > max_output_chars:
+                            break
+            finally:
+                await stream.close()
+            return "".join(parts).strip()
+
+        response = await openai_client.responses.create(
             model=model_to_use,
-            instructions="Give me back text only, no markdown or other formatting",
+            instructions=system_instructions,
             input=prompt,
         )
 
@@ -29,11 +267,11 @@ def generate_with_openai(prompt: str, model: Optional[str] = None) -> str:
 
         return result
     except Exception as e:
-        logger.error(f"OpenAI API error: {e}")
-        raise e
+        logger.error("OpenAI API error: %s", e)
+        raise
 
 
-def generate_with_anthropic(
+async def generate_with_anthropic(
     prompt: str, model: Optional[str] = None, response_schema: Optional[type] = None
 ) -> str:
     """Generate response using Anthropic Claude API"""
@@ -41,26 +279,28 @@ def generate_with_anthropic(
     try:
         if response_schema:
             # Use structured output with Claude
-            response = anthropic_client.messages.create(
+            response = await anthropic_client.messages.create(
                 model=model_to_use,
                 max_tokens=5000,
+                system=anthropic_system,
                 messages=[{"role": "user", "content": prompt}],
                 response_format={"type": "json_object"},
             )
             result = response.content[0].text
         else:
             # Use regular text output
-            response = anthropic_client.messages.create(
+            response = await anthropic_client.messages.create(
                 model=model_to_use,
                 max_tokens=5000,
+                system=anthropic_system,
                 messages=[{"role": "user", "content": prompt}],
             )
             result = response.content[0].text
 
         return result
     except Exception as e:
-        logger.error(f"Anthropic API error: {e}")
-        raise e
+        logger.error("Anthropic API error: %s", e)
+        raise
 
 
 def generate_with_provider(
@@ -68,14 +308,122 @@ def generate_with_provider(
     provider: str = "openai",
     model: Optional[str] = None,
     response_schema: Optional[type] = None,
+    timeout: Optional[float] = request_timeout,
+    max_output_chars: int = 0,
 ) -> str:
-    """Generate response using specified AI provider"""
-    if provider.lower() == "openai":
-        return generate_with_openai(prompt, model)
-    elif provider.lower() == "anthropic":
-        return generate_with_anthropic(prompt, model, response_schema)
-    else:
+    """Generate response using specified AI provider
+
+    Concurrent calls for the same provider, model and prompt are coalesced: the
+    first caller makes the request and the others wait on its result. After a
+    rate-limit, server or connection error the provider is skipped for a few
+    seconds and ProviderUnavailableError is raised instead.
+    max_output_chars > 0 lets OpenAI stop generating once that much text has
+    arrived; the result may then be cut off and should be truncated by the caller.
+    """
+    provider = provider.lower()
+    if provider not in ("openai", "anthropic"):
         error_msg = (
             f"Unknown provider: {provider}. Supported providers: openai or anthropic"
         )
         raise ValueError(error_msg)
+
+    cache_key = None
+    if response_cache is not None:
+        cache_key = make_key(provider, model, prompt, max_output_chars)
+        try:
+            cached = response_cache.get(cache_key)
+        except Exception as e:
+            # A locked or corrupt database shouldn't fail the query; treat as a miss
+            logger.warning("Persistent cache read failed: %s", e)
+            cached = None
+        if cached is not None:
+            logger.info("Persistent cache hit")
+            return cached
+
+    if time.monotonic() < _provider_cooldown.get(provider, 0.0):
+        raise ProviderUnavailableError(f"{provider} is cooling down after an error")
+
+    key = hashlib.sha1(
+        f"{provider}|{model}|{response_schema}|{max_output_chars}|{prompt}".encode(
+            "utf-8"
+        )
+    ).hexdigest()
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = _inflight[key] = concurrent.futures.Future()
+    if not is_leader:
+        return future.result(timeout=timeout)
+
+    try:
+        result, semantic_hit = _generate(
+            prompt, provider, model, response_schema, timeout, max_output_chars
+        )
+    except BaseException as e:
+        if isinstance(e, TRANSIENT_ERRORS) and not isinstance(e, TIMEOUT_ERRORS):
+            _provider_cooldown[provider] = time.monotonic() + provider_cooldown_seconds
+            logger.warning(
+                "%s failed, pausing calls for %ss", provider, provider_cooldown_seconds
+            )
+        future.set_exception(e)
+        raise
+    else:
+        # Release followers before the cache write, which may be slow or fail
+        future.set_result(result)
+        # A semantic hit may be nearly ttl old already; rewriting it would
+        # give it a fresh created_at on disk
+        if cache_key is not None and not semantic_hit:
+            try:
+                response_cache.set(cache_key, result)
+            except Exception as e:
+                logger.warning("Persistent cache write failed: %s", e)
+        return result
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+def _generate(
+    prompt: str,
+    provider: str,
+    model: Optional[str],
+    response_schema: Optional[type],
+    timeout: Optional[float],
+    max_output_chars: int,
+) -> Tuple[str, bool]:
+    """Answer from the semantic cache if enabled, otherwise call the provider
+
+    Returns the answer and whether it came from the semantic cache. The
+    embedding and provider calls share a single timeout budget, so the leader
+    finishes within the time single-flight followers are willing to wait.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def remaining() -> Optional[float]:
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    embedding = None
+    if semantic_cache is not None:
+        try:
+            embedding = semantic_cache.embed(prompt, remaining())
+        except Exception as e:
+            logger.warning("Embedding error, skipping semantic cache: %s", e)
+        else:
+            cached = semantic_cache.lookup(embedding)
+            if cached is not None:
+                logger.info("Semantic cache hit")
+                return cached, True
+
+    if provider == "openai":
+        result = _run_on_loop(
+            generate_with_openai(prompt, model, max_output_chars), remaining()
+        )
+    else:
+        result = _run_on_loop(
+            generate_with_anthropic(prompt, model, response_schema), remaining()
+        )
+
+    if embedding is not None:
+        semantic_cache.add(embedding, result)
+    return result, False
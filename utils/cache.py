@@ -0,0 +1,132 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+from utils.text_formatting import normalize_prompt
+
+# Answers longer than this are stored zlib-compressed
+COMPRESS_THRESHOLD = 1024
+
+
+def make_key(
+    provider: str, model: Optional[str], prompt: str, max_output_chars: int = 0
+) -> bytes:
+    """Build a cache key from the provider, model, length cap and normalized prompt"""
+    raw = f"{provider}|{model or ''}|{max_output_chars}|{normalize_prompt(prompt)}"
+    return hashlib.sha256(raw.encode("utf-8")).digest()
+
+
+class MemoryCache:
+    """Thread-safe in-process LRU of final answers, keyed by normalized prompt.
+
+    With a ttl, entries expire like ResponseCache rows do, so an answer loaded
+    into memory is not served for longer than the persistent cache would.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # key -> (answer, monotonic expiry time or None)
+        self._entries: OrderedDict[str, tuple[str, Optional[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, count_miss: bool = True) -> Optional[str]:
+        """Return the unexpired answer for key; count_miss=False for pre-checks"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                answer, expires_at = entry
+                if expires_at is None or time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return answer
+                del self._entries[key]
+            if count_miss:
+                self.misses += 1
+            return None
+
+    def set(self, key: str, answer: str) -> None:
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (answer, expires_at)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class ResponseCache:
+    """SQLite-backed answer cache with a TTL, persisted across restarts.
+
+    Short answers are stored as TEXT and long ones as compressed BLOBs; the
+    column type of each row tells get() which it is.
+    """
+
+    def __init__(self, path: str, ttl: int = 3600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key BLOB PRIMARY KEY, answer TEXT NOT NULL, created_at INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: bytes, ttl: Optional[int] = None) -> Optional[str]:
+        """Return the cached answer for key if it is younger than ttl seconds.
+
+        An expired row is deleted when found, so the file doesn't keep growing
+        between the purge_expired() calls made at startup.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            answer, created_at = row
+            if int(time.time()) - created_at >= ttl:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key = ? AND created_at = ?",
+                    (key, created_at),
+                )
+                self._conn.commit()
+                return None
+        if isinstance(answer, bytes):
+            return zlib.decompress(answer).decode("utf-8")
+        return answer
+
+    def set(self, key: bytes, answer: str) -> None:
+        value = answer
+        encoded = answer.encode("utf-8")
+        if len(encoded) > COMPRESS_THRESHOLD:
+            value = zlib.compress(encoded)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, answer, created_at) "
+                "VALUES (?, ?, ?)",
+                (key, value, int(time.time())),
+            )
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        """Delete entries older than the TTL and return how many were removed"""
+        cutoff = int(time.time()) - self.ttl
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE created_at <= ?", (cutoff,)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,32 +1,56 @@
+import binascii
+import re
 from typing import List, Tuple, Optional
 
+from dnslib.label import DNSLabel
 
-def chunk_text_for_txt_record(text: str, max_chunk_bytes: int = 200) -> List[str]:
+_WHITESPACE_RE = re.compile(r"\s+")
+_URLSAFE_TRANS = bytes.maketrans(b"-_", b"+/")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a prompt for cache lookups: lowercase and collapse whitespace."""
+    return _WHITESPACE_RE.sub(" ", prompt).strip().lower()
+
+
+def _char_start(data: bytes, index: int) -> bool:
+    """True if index is not inside a multi-byte UTF-8 sequence"""
+    return index >= len(data) or data[index] & 0xC0 != 0x80
+
+
+def chunk_text_for_txt_record(text: str, max_chunk_bytes: int = 200) -> List[bytes]:
     """Split text into chunks that fit within a single DNS TXT string (<=255 bytes).
 
-    We conservatively cap each chunk to max_chunk_bytes to account for encoding.
+    Chunks are UTF-8 bytes, ready to pass to dnslib's TXT without re-encoding,
+    and are measured in bytes, the unit of the TXT limit. Chunks break at the
+    last space that fits; a word longer than the budget is split mid-word, never
+    inside a character.
     """
-    if not text:
-        return [""]
-    chunks: List[str] = []
-    current: List[str] = []
-    current_len = 0
-    for word in text.split():
-        # Include space if current isn't empty
-        add_len = (1 if current else 0) + len(word)
-        if current_len + add_len > max_chunk_bytes:
-            chunks.append(" ".join(current))
-            current = [word]
-            current_len = len(word)
+    data = _WHITESPACE_RE.sub(" ", text).strip().encode("utf-8")
+    if not data:
+        return [b""]
+    chunks: List[bytes] = []
+    start = 0
+    end = len(data)
+    while end - start > max_chunk_bytes:
+        # A space right after the budget still lets the chunk fill it completely
+        split = data.rfind(b" ", start, start + max_chunk_bytes + 1)
+        if split <= start:
+            split = start + max_chunk_bytes
+            while split > start and not _char_start(data, split):
+                split -= 1
+            if split == start:  # budget smaller than one character
+                split += 1
+                while not _char_start(data, split):
+                    split += 1
+            chunks.append(data[start:split])
+            start = split
         else:
-            if current:
-                current_len += 1  # space
-            current.append(word)
-            current_len += len(word)
-    if current:
-        chunks.append(" ".join(current))
-    if not chunks:
-        chunks = [""]
+            chunks.append(data[start:split])
+            start = split + 1
+    # A hard split can end exactly at the end of the text
+    if start < end:
+        chunks.append(data[start:])
     return chunks
 
 
@@ -42,13 +66,10 @@ def extract_api_key_and_question(qname: object) -> Tuple[Optional[str], str]:
     Returns:
         Tuple of (api_key, question) where api_key is None if not provided
     """
-    from dnslib.label import DNSLabel
-    import base64
-
     if isinstance(qname, str):
         qname = DNSLabel(qname)
 
-    labels: List[bytes] = list(qname.label)
+    labels: Tuple[bytes, ...] = qname.label
     if labels and labels[-1] == b"":  # trailing root
         labels = labels[:-1]
 
@@ -56,28 +77,24 @@ def extract_api_key_and_question(qname: object) -> Tuple[Optional[str], str]:
     decoded_parts: List[str] = []
 
     for i, raw in enumerate(labels):
-        try:
-            s = raw.decode("utf-8", errors="replace")
-        except Exception:
-            s = str(raw)
-
+        # Prefixes are matched on the raw bytes; only the payload gets decoded
         # Check if this is an API key label (should be first)
-        if i == 0 and s.startswith("key-"):
-            api_key = s[4:]  # Extract API key after "key-"
+        if i == 0 and raw.startswith(b"key-"):
+            api_key = raw[4:].decode("utf-8", errors="replace")
             continue
 
-        if s.startswith("b64-"):
-            enc = s[4:]
+        if raw.startswith(b"b64-") and raw.isascii():
             try:
-                # base64url without padding
-                pad = "=" * (-len(enc) % 4)
-                decoded = base64.urlsafe_b64decode((enc + pad).encode("ascii")).decode(
-                    "utf-8", errors="replace"
-                )
+                # base64url without padding: map to the standard alphabet and
+                # append "==", which the lenient decoder ignores when unneeded
+                decoded = binascii.a2b_base64(
+                    raw[4:].translate(_URLSAFE_TRANS) + b"==", strict_mode=False
+                ).decode("utf-8", errors="replace")
                 decoded_parts.append(decoded)
                 continue
             except Exception:
                 pass
+        s = raw.decode("utf-8", errors="replace")
         # Handle spaces within labels (from quoted dig commands)
         # Replace underscores with spaces for better readability
         s = s.replace("_", " ")
@@ -0,0 +1,149 @@
+import socket
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from dnslib import RCODE, DNSError, DNSRecord
+
+
+class BatchedUDPServer(socketserver.UDPServer):
+    """UDP server that drains datagrams in batches onto a fixed worker pool.
+
+    dnslib's default UDPServer wakes up once per datagram and spawns a new
+    thread for each one. This server reads up to batch_size datagrams per
+    wakeup with non-blocking recvfrom and hands them to a ThreadPoolExecutor,
+    so a burst of queries costs one selector wakeup and no thread creation
+    per packet. Pass it to DNSServer as server=BatchedUDPServer.
+
+    Workers can block on slow LLM calls, so two things keep them from stalling
+    everything else. If the resolver has a resolve_cached(request) method, it
+    is tried on the reader thread first, and cache hits are answered without
+    queueing. At most max_workers + max_queued requests wait for a worker;
+    beyond that, queries are answered with SERVFAIL so clients retry later.
+
+    With reuse_port=True several instances can bind the same address and the
+    kernel spreads incoming flows across their sockets (SO_REUSEPORT);
+    incoming_cpu additionally prefers packets received on that CPU.
+    """
+
+    allow_reuse_address = True
+    batch_size = 32
+    max_workers = 64
+    max_queued = 256
+
+    def __init__(
+        self,
+        server_address,
+        handler,
+        bind_and_activate: bool = True,
+        reuse_port: bool = False,
+        incoming_cpu: Optional[int] = None,
+    ):
+        if server_address[0] != "" and ":" in server_address[0]:
+            self.address_family = socket.AF_INET6
+        self.allow_reuse_port = reuse_port
+        self.incoming_cpu = incoming_cpu
+        super().__init__(server_address, handler, bind_and_activate)
+        # The socket stays blocking so replies sent from workers are never
+        # dropped with EAGAIN; reads use MSG_DONTWAIT instead (see get_request).
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queued)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="dns-udp"
+        )
+
+    def server_bind(self) -> None:
+        if self.incoming_cpu is not None and hasattr(socket, "SO_INCOMING_CPU"):
+            self.socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_INCOMING_CPU, self.incoming_cpu
+            )
+        super().server_bind()
+
+    def get_request(self):
+        data, client_address = self.socket.recvfrom(
+            self.max_packet_size, socket.MSG_DONTWAIT
+        )
+        return (data, self.socket), client_address
+
+    # serve_forever() calls this once the socket is readable; read the whole
+    # batch here instead of returning to the selector after every datagram.
+    def _handle_request_noblock(self) -> None:
+        for _ in range(self.batch_size):
+            try:
+                request, client_address = self.get_request()
+            except OSError:  # BlockingIOError once the socket is drained
+                return
+            if not self.verify_request(request, client_address):
+                continue
+            if self._answer_inline(request, client_address):
+                continue
+            self._executor.submit(self.process_request_thread, request, client_address)
+
+    def _answer_inline(self, request, client_address) -> bool:
+        """Reply on the reader thread from cache, or shed load; False to queue"""
+        data, sock = request
+        handler = _InlineHandler(self, request, client_address)
+        resolve_cached = getattr(self.resolver, "resolve_cached", None)
+        if resolve_cached is not None:
+            try:
+                query = DNSRecord.parse(data)
+                reply = resolve_cached(query)
+            except Exception:
+                reply = None  # let a worker handle and log it
+            if reply is not None:
+                self._reply_inline(handler, query, reply)
+                return True
+
+        if self._slots.acquire(blocking=False):
+            return False
+        try:
+            query = DNSRecord.parse(data)
+        except DNSError as e:
+            self.logger.log_recv(handler, data)
+            self.logger.log_error(handler, e)
+            return True
+        reply = query.reply()
+        reply.header.rcode = RCODE.SERVFAIL
+        self._reply_inline(handler, query, reply)
+        return True
+
+    def _reply_inline(self, handler: "_InlineHandler", query, reply) -> None:
+        """Send a reply from the reader thread, logged as DNSHandler would"""
+        data, sock = handler.request
+        self.logger.log_recv(handler, data)
+        self.logger.log_request(handler, query)
+        self.logger.log_reply(handler, reply)
+        rdata = reply.pack()
+        self.logger.log_send(handler, rdata)
+        self._send(sock, rdata, handler.client_address)
+
+    @staticmethod
+    def _send(sock: socket.socket, data: bytes, client_address) -> None:
+        try:
+            sock.sendto(data, client_address)
+        except OSError:
+            pass  # client unreachable; UDP offers no delivery guarantee anyway
+
+    def process_request_thread(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _InlineHandler:
+    """Stand-in for DNSHandler in DNSLogger calls for replies sent inline"""
+
+    protocol = "udp"
+
+    def __init__(self, server: BatchedUDPServer, request, client_address):
+        self.server = server
+        self.request = request
+        self.client_address = client_address